@@ -25,14 +25,87 @@
 
 
 import argparse
-import collections
+import asyncio
+import concurrent.futures
+import ctypes
+import ctypes.util
+import email.message
 import functools
-import multiprocessing
+import os
 import re
-import shlex
+import signal
 import smtplib
-import subprocess
-import time
+import struct
+import syslog as _syslog
+import threading
+import traceback
+
+try:
+    import re._parser as sre_parse
+except ImportError:
+    # Python < 3.11
+    import sre_parse
+
+try:
+    # google-re2; linear time matching, no catastrophic backtracking
+    import re2
+except ImportError:
+    re2 = None
+
+
+# inotify(7) constants, from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_IGNORED = 0x00008000
+IN_CLOEXEC = 0o2000000
+# Watched on the parent directories, to follow files across
+# rotation (moved away and recreated) and removal
+IN_DIR_EVENTS = IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+# struct inotify_event {int wd; uint32_t mask, cookie, len; char name[];}
+_INOTIFY_EVENT = struct.Struct('iIII')
+# Enough room for a good number of queued events in one read(2)
+_INOTIFY_BUFSIZE = 64 * (_INOTIFY_EVENT.size + 256)
+
+# RE2 flag prefix for ^ and $ to match at line boundaries
+_RE2_MULTILINE = b'(?m)'
+
+# sre_parse categories (\s, \d etc.) that do, and do not,
+# match a newline
+_NEWLINE_CATEGORIES = frozenset((
+    'CATEGORY_SPACE', 'CATEGORY_NOT_DIGIT', 'CATEGORY_NOT_WORD',
+    'CATEGORY_LINEBREAK',
+))
+_NON_NEWLINE_CATEGORIES = frozenset((
+    'CATEGORY_DIGIT', 'CATEGORY_WORD', 'CATEGORY_NOT_SPACE',
+    'CATEGORY_NOT_LINEBREAK',
+))
+
+# Bytes kept from the end of the read content of a file, to
+# detect it being truncated and rewritten
+_TAIL_SIZE = 64
+
+# Compiled pattern types accepted by base_verifier_sender
+_PATTERN_TYPES = (re.Pattern,) if re2 is None else (
+    re.Pattern, type(re2.compile('')))
+
+# Fixed start of every mail body
+_MAIL_HEADER = 'Mail sent by filewatcher.\n\n'
+
+# Long-lived SMTP connection, opened lazily by send_mail;
+# shared by all worker threads
+_SMTP = None
+# Seconds to wait on the SMTP server before giving up
+_SMTP_TIMEOUT = 30
+_SMTP_LOCK = threading.Lock()
+
+# Log to /dev/log directly, no logger(1) process per message
+_syslog.openlog('filewatcher', logoption=_syslog.LOG_PID,
+                facility=_syslog.LOG_LOCAL0)
+
+_libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
 
 
 class FileWatcherException(Exception):
@@ -57,7 +130,15 @@ def parse_arguments():
                         dest='regex',
                         required=True,
                         help=(
-                            'The Python Regular Expression pattern to match'
+                            'The Python Regular Expression pattern to match. '
+                            'Character classes like \\w, \\d and \\s match '
+                            'ASCII characters only, as the pattern is '
+                            'matched against the raw (UTF-8) bytes of the '
+                            'files. If the google-re2 '
+                            'package is installed, the pattern is matched '
+                            'by RE2 in linear time; patterns using features '
+                            'RE2 does not support (e.g. backreferences, '
+                            'lookaround) fall back to Python re'
                         )
     )
     parser.add_argument('-f', '--file',
@@ -104,53 +185,204 @@ def parse_arguments():
     return args_dict
 
 
-def _run_command(command, shell=True):
-    '''Takes a command string and after running the
-    command returns a tuple containing the exit
-    status, STDOUT and STDERR.
+def _inotify_init():
+    '''Returns a new (blocking) inotify file descriptor.'''
+    fd = _libc.inotify_init1(IN_CLOEXEC)
+    if fd < 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+    return fd
+
+
+def _inotify_add_watch(fd, path, mask):
+    '''Adds a watch for path on the inotify instance fd,
+    and returns the watch descriptor.
     '''
-    command = command if shell else shlex.split(command)
-    popen_obj = subprocess.Popen(
-        command,
-        shell=shell,
-        bufsize=0,  # unbuffered
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    )
-    stdout, stderr = popen_obj.communicate()
-    returncode = popen_obj.wait()
+    wd = _libc.inotify_add_watch(fd, os.fsencode(path), mask)
+    if wd < 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno), path)
+    return wd
 
-    return (
-        returncode,
-        stdout.decode('utf-8').strip(),
-        stderr.decode('utf-8').strip()
-    )
-    
 
-def send_mail(from_addr, to_addrs, subject, body):
-    '''Takes required parameters and sends an email.'''
-    to_addrs_str = ', '.join(to_addrs)
-    subject = 'Filewatcher: {}'.format(subject)
-    body = 'Mail sent by filewatcher.\n\n{}\n'.format(body)
+def _inotify_rm_watch(fd, wd):
+    '''Removes the watch wd from the inotify instance fd;
+    the watch may already be gone, which is ignored.
+    '''
+    _libc.inotify_rm_watch(fd, wd)
 
-    message = 'From: {}\nTo: {}\nSubject: {}\n\n{}\n'.format(
-        from_addr, to_addrs_str, subject, body)
 
-    try:
-        smtp_client = smtplib.SMTP('localhost', 25)
-        smtp_client.sendmail(from_addr, to_addrs, message)
-    finally:
-        smtp_client.close()
+def _inotify_read(fd):
+    '''Blocks until events are available on the inotify
+    instance fd, and returns a list of (wd, mask, name)
+    tuples; name is empty for events on the watched
+    file itself.
+    '''
+    data = os.read(fd, _INOTIFY_BUFSIZE)
+    events = []
+    offset = 0
+    while offset < len(data):
+        wd, mask, _, name_len = _INOTIFY_EVENT.unpack_from(data, offset)
+        offset += _INOTIFY_EVENT.size
+        name = data[offset:offset + name_len].rstrip(b'\0')
+        events.append((wd, mask, name))
+        offset += name_len
+    return events
+
+
+def send_mail(from_addr, to_addrs, subject, body):
+    '''Takes required parameters and sends an email
+    over the long-lived SMTP connection.
+    '''
+    global _SMTP
+    message = email.message.EmailMessage()
+    message['From'] = from_addr
+    message['To'] = ', '.join(to_addrs)
+    message['Subject'] = f'Filewatcher: {subject}'
+    message.set_content(f'{_MAIL_HEADER}{body}\n')
+
+    # Reuse the open connection; if the server has dropped
+    # it meanwhile, reconnect and retry once
+    with _SMTP_LOCK:
+        for retry in (False, True):
+            if _SMTP is None:
+                _SMTP = smtplib.SMTP('localhost', 25, timeout=_SMTP_TIMEOUT)
+                _SMTP.ehlo()
+            try:
+                _SMTP.send_message(message, from_addr, to_addrs)
+                return
+            except (smtplib.SMTPServerDisconnected, ConnectionError,
+                    TimeoutError):
+                _SMTP.close()
+                _SMTP = None
+                if retry:
+                    raise
             
 
 def log_syslog(message):
-    '''Logs message to syslog. Returns True
-    if succeeds, False otherwise.'''
-    command = '/usr/bin/logger --priority local0.info \
-                filewatcher: {}'.format(message)
-    if _run_command(command, shell=False)[0] == 0:
-        return True
-    return False
+    '''Logs message to syslog. Returns True, as
+    syslog(3) does not report failures.'''
+    _syslog.syslog(_syslog.LOG_INFO, message)
+    return True
+
+
+@functools.lru_cache(maxsize=128)
+def compile_regex(pattern):
+    '''Compiles pattern with RE2 if available (and the
+    pattern is supported by RE2), with Python re otherwise.
+    The pattern is compiled as bytes, to match the raw
+    (UTF-8) content of the files without decoding it.
+    Compiled patterns are cached, so this can be called
+    again with the same pattern without recompiling it;
+    base_verifier_sender only ever gets the result.
+    '''
+    pattern = pattern.encode('utf-8')
+    # Patterns are matched against multiple lines at once, so
+    # ^ and $ must match at line boundaries; DOTALL is not used,
+    # as it would let . (and so .*) run across lines
+    if re2 is not None:
+        try:
+            return re2.compile(_RE2_MULTILINE + pattern)
+        except re2.error:
+            pass
+    # \w, \d, \s etc. match ASCII only, like RE2
+    return re.compile(pattern, re.ASCII | re.MULTILINE)
+
+
+def _pattern_bytes(regex):
+    '''Returns the pattern of regex (compiled by compile_regex)
+    as given by the user, i.e. without any prefix added for RE2.
+    '''
+    pattern = regex.pattern
+    if not isinstance(regex, re.Pattern):
+        pattern = pattern[len(_RE2_MULTILINE):]
+    return pattern
+
+
+def pattern_str(regex):
+    '''Returns the user's pattern of regex as str.'''
+    return _pattern_bytes(regex).decode('utf-8', errors='replace')
+
+
+def _in_is_line_local(items):
+    '''Returns True if the character class items (from
+    sre_parse) cannot match a newline.
+    '''
+    negate = False
+    has_newline = False
+    for op, av in items:
+        op = str(op)
+        if op == 'NEGATE':
+            negate = True
+        elif op == 'LITERAL':
+            has_newline |= av == 10
+        elif op == 'RANGE':
+            has_newline |= av[0] <= 10 <= av[1]
+        elif op == 'CATEGORY' and str(av) in _NEWLINE_CATEGORIES:
+            has_newline = True
+        elif op != 'CATEGORY' or str(av) not in _NON_NEWLINE_CATEGORIES:
+            return False
+    return has_newline if negate else not has_newline
+
+
+def _parsed_is_line_local(parsed):
+    '''Returns True if the pattern parsed by sre_parse cannot
+    match across a newline or look past one, see is_line_local.
+    '''
+    for op, av in parsed:
+        op = str(op)
+        if op == 'LITERAL':
+            local = av != 10
+        elif op == 'NOT_LITERAL':
+            local = av == 10
+        elif op in ('ANY', 'GROUPREF'):
+            local = True
+        elif op == 'IN':
+            local = _in_is_line_local(av)
+        elif op == 'AT':
+            # \B never matches an empty string, but does match
+            # an empty line within a chunk
+            local = str(av) not in (
+                'AT_BEGINNING_STRING', 'AT_END_STRING', 'AT_NON_BOUNDARY'
+            )
+        elif op == 'BRANCH':
+            local = all(_parsed_is_line_local(p) for p in av[1])
+        elif op == 'SUBPATTERN':
+            _, add_flags, del_flags, p = av
+            local = (not (add_flags | del_flags) & (re.DOTALL | re.MULTILINE)
+                     and _parsed_is_line_local(p))
+        elif op in ('MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT'):
+            local = _parsed_is_line_local(av[2])
+        elif op in ('ASSERT', 'ASSERT_NOT'):
+            local = _parsed_is_line_local(av[1])
+        elif op == 'ATOMIC_GROUP':
+            local = _parsed_is_line_local(av)
+        elif op == 'GROUPREF_EXISTS':
+            local = all(_parsed_is_line_local(p) for p in av[1:] if p)
+        else:
+            local = False
+        if not local:
+            return False
+    return True
+
+
+def is_line_local(regex):
+    '''Returns True if regex (compiled by compile_regex) can
+    neither match across a newline, nor see past one (via \\A,
+    \\Z or lookaround); matching it against a whole chunk then
+    finds the same lines as matching each line on its own.
+    This is conservative: patterns that cannot be analysed
+    (e.g. RE2 only syntax) are taken as not line local.
+    '''
+    try:
+        parsed = sre_parse.parse(
+            _pattern_bytes(regex), re.ASCII | re.MULTILINE
+        )
+    except Exception:
+        return False
+    if parsed.state.flags & re.DOTALL:
+        return False
+    return _parsed_is_line_local(parsed)
 
 
 def check_input_combo(one, two, exc_msg):
@@ -164,50 +396,83 @@ def check_input_combo(one, two, exc_msg):
     return True
 
 
-def base_verifier_sender(new_lines, syslog, from_addr, to_addrs, regex, file_):
-    '''Checks for the match in new_lines; if found, logs
-    to syslog, and/or send mail based in input args.
+def base_verifier_sender(chunk, start, end, start_line_no, regex, dispatch,
+                         per_line=False):
+    '''Checks for the match in chunk[start:end] (bytes of newline
+    separated lines, the first one being line start_line_no);
+    if found, calls dispatch with the matched lines string.
+    regex must be a compiled pattern (see compile_regex),
+    not a string. per_line must be true unless regex is line
+    local (see is_line_local).
     '''
-    # Matched lines dict with line_no as key
-    # and line string as value
-    matched_lines = collections.OrderedDict()
-    for line in new_lines:
-        try:
-            line_no, line = line.split(maxsplit=1)
-        except ValueError:
-            continue
-        if regex.search(line):
-            matched_lines[line_no] = line
+    assert isinstance(regex, _PATTERN_TYPES)
+    # Matched (line_no, line) tuples, in order
+    matched_lines = []
+    pos = start
+    line_no = start_line_no
+    if per_line:
+        # Each line is searched on its own, so nothing outside
+        # it can take part in (or slow down) the match
+        while pos <= end:
+            line_end = chunk.find(b'\n', pos, end)
+            if line_end == -1:
+                line_end = end
+            line = chunk[pos:line_end]
+            if regex.search(line):
+                matched_lines.append((line_no, line))
+            pos = line_end + 1
+            line_no += 1
+    else:
+        # The whole chunk is scanned by the engine, which finds
+        # the line boundaries itself (^ and $ are multiline);
+        # pos is always at the start of line no line_no
+        while pos <= end:
+            match = regex.search(chunk, pos, end)
+            if match is None:
+                break
+            match_start = match.start()
+            line_start = chunk.rfind(b'\n', pos, match_start) + 1 or pos
+            line_no += chunk.count(b'\n', pos, line_start)
+            line_end = chunk.find(b'\n', match_start, end)
+            if line_end == -1:
+                line_end = end
+            matched_lines.append((line_no, chunk[line_start:line_end]))
+            # Any other match on this line is not needed
+            pos = line_end + 1
+            line_no += 1
 
     if matched_lines:
-        matched_lines_str = '\n'.join([
-            'line_no:{}::{}'.format(line_no, line)
-            for line_no, line in matched_lines.items()
-        ])
-        if syslog:
-            log_syslog('file: {}:: {}'.format(
-                file_, matched_lines_str)
-            )
-        if from_addr:
-            send_mail(
-                from_addr,
-                to_addrs,
-                'Regex pattern {} matched in {}'.format(
-                    regex.pattern, file_
-                ),
-                'Regex: {}\nFile: {}\n\n{}\n'.format(
-                    regex.pattern,
-                    file_,
-                    matched_lines_str
-                )
-            )
-        
-
-def base_watcher(file_, regex, syslog, from_addr, to_addrs):
-    '''Takes a compiled Regex and a file to  watch; sets
-    watches on the file using inotifywait (uses inotify(2)).
-    Checks if the appended content matches the given Regex
-    pattern; if so, send_mail and/or log_syslog.
+        # Decoded only here, for logging/mailing
+        matched_lines_str = b'\n'.join([
+            b'line_no:%d::%s' % (line_no, line)
+            for line_no, line in matched_lines
+        ]).decode('utf-8', errors='replace')
+        dispatch(matched_lines_str)
+
+
+def _read_to_end(file_obj):
+    '''Reads file_obj to EOF in blocks, and returns a tuple
+    containing the number of complete lines read and the
+    trailing unterminated line.
+    '''
+    line_no = 0
+    pending = b''
+    for block in iter(functools.partial(file_obj.read, 1 << 20), b''):
+        line_no += block.count(b'\n')
+        _, sep, tail = block.rpartition(b'\n')
+        pending = tail if sep else pending + tail
+    return line_no, pending
+
+
+def base_watcher(file_, regex, syslog, from_addr, to_addrs,
+                 from_start=False):
+    '''Takes a compiled Regex and a file to watch; returns
+    a function to be called whenever the file is modified.
+    The function checks if the appended content matches the
+    given Regex pattern; if so, send_mail and/or log_syslog.
+    Content already in the file is skipped, unless from_start
+    is true (e.g. for a newly created file). The function's
+    close attribute closes the file.
     '''
     if not any([syslog, from_addr, to_addrs]):
         raise FileWatcherException(
@@ -219,45 +484,257 @@ def base_watcher(file_, regex, syslog, from_addr, to_addrs):
     check_input_combo(to_addrs, from_addr,
                       'No mail from address specified')
 
-    # Set up commands
-    inotify_cmd = (
-        'inotifywait --quiet --monitor -- {} | '.format(file_)
-        + 'grep -qi MODIFY'
-    )
-    tail_cmd = 'nl -ba {file_} | tail -n +{line_no}'.format
-    tail_cmd_partial = functools.partial(
-        tail_cmd, file_=file_
-    )
-    # Line offset seen/processed so far
-    line_no = 0
+    pattern = pattern_str(regex)
+    # Patterns that could match across lines are checked line
+    # by line, to keep per line semantics and linear time
+    per_line = not is_line_local(regex)
 
-    while True:
-        if _run_command(inotify_cmd, shell=True)[0] == 0:
-            # Splitted new lines with line no
-            new_lines_ = _run_command(
-                tail_cmd_partial(line_no=line_no + 1)
-            )[1].splitlines()
-            
-            # Set line_no
-            try:
-                line_no = int(new_lines_[-1].split()[0])
-            # File truncated
-            except IndexError:
-                line_no = 1
-            
-            base_verifier_sender(
-                new_lines_, syslog, from_addr, to_addrs, regex, file_
-            )
-        time.sleep(0.1)
+    def dispatch_syslog(matched_lines_str):
+        log_syslog(f'file: {file_}:: {matched_lines_str}')
 
+    def dispatch_mail(matched_lines_str):
+        send_mail(
+            from_addr,
+            to_addrs,
+            f'Regex pattern {pattern} matched in {file_}',
+            f'Regex: {pattern}\nFile: {file_}\n\n{matched_lines_str}\n'
+        )
 
-def mp_error_callback(exc):
-    '''For any error from the multiprocessing
-    map_async, this function is called with the
-    exception as the argument. Here, logging
-    the exception to syslog.
+    def dispatch_both(matched_lines_str):
+        dispatch_syslog(matched_lines_str)
+        dispatch_mail(matched_lines_str)
+
+    # Whether to log and/or mail is fixed for the watcher's
+    # lifetime, so it is decided once here
+    if syslog and from_addr:
+        dispatch = dispatch_both
+    elif syslog:
+        dispatch = dispatch_syslog
+    else:
+        dispatch = dispatch_mail
+
+    # Kept open across events; new content is read from
+    # the last seen offset onwards
+    file_obj = open(file_, 'rb')
+    # Line no seen/processed so far, and the trailing
+    # unterminated line (if any) pending completion
+    if from_start:
+        line_no, pending = 0, b''
+    else:
+        line_no, pending = _read_to_end(file_obj)
+    last_pos = file_obj.tell()
+    # The last bytes read (up to _TAIL_SIZE, ending at last_pos);
+    # if they change, the file was truncated and rewritten
+    tail = os.pread(file_obj.fileno(), min(_TAIL_SIZE, last_pos),
+                    last_pos - min(_TAIL_SIZE, last_pos))
+
+    # Reused for reading appended content on every event, and
+    # only grown (doubled) when a single line does not fit;
+    # buf[:filled] is the pending unterminated line
+    buf = bytearray(max(1 << 20, 2 * len(pending)))
+    filled = len(pending)
+    buf[:filled] = pending
+
+    def on_modify():
+        nonlocal line_no, last_pos, buf, filled, tail
+        fd = file_obj.fileno()
+        # File truncated (and maybe written past the old size
+        # since), start over from the beginning
+        if (os.fstat(fd).st_size < last_pos
+                or os.pread(fd, len(tail), last_pos - len(tail)) != tail):
+            log_syslog(f'file: {file_}:: truncated, reading from the start')
+            last_pos, line_no, filled, tail = 0, 0, 0, b''
+
+        # Large appends are read and scanned in windows of at
+        # most len(buf) bytes, so memory use stays bounded
+        file_obj.seek(last_pos)
+        while True:
+            if filled == len(buf):
+                buf.extend(bytes(len(buf)))
+            read = file_obj.readinto(memoryview(buf)[filled:])
+            if not read:
+                break
+            filled += read
+            if read >= _TAIL_SIZE:
+                tail = bytes(buf[filled - _TAIL_SIZE:filled])
+            else:
+                tail = (tail + buf[filled - read:filled])[-_TAIL_SIZE:]
+
+            # Only complete lines are checked, the trailing
+            # unterminated one is kept pending
+            end = buf.rfind(b'\n', 0, filled)
+            if end != -1:
+                base_verifier_sender(
+                    buf, 0, end, line_no + 1, regex, dispatch, per_line
+                )
+                line_no += buf.count(b'\n', 0, end) + 1
+                # Move the pending line to the start
+                filled -= end + 1
+                buf[:filled] = buf[end + 1:end + 1 + filled]
+        last_pos = file_obj.tell()
+
+    on_modify.close = file_obj.close
+    return on_modify
+
+
+async def amain(watch_files, regex, syslog, from_addr, to_addrs):
+    '''Watches all of watch_files using a single inotify
+    instance multiplexed on the event loop, and runs the
+    base_watcher of the modified files. Files are followed
+    by path, so a rotated (moved away and recreated) or
+    recreated file is picked up again.
     '''
-    return log_syslog('filewatcher: {}'.format(str(exc)))
+    loop = asyncio.get_running_loop()
+    inotify_fd = _inotify_init()
+
+    # File to its base_watcher function, file watch descriptor
+    # to file (and back), and parent directory watch descriptor
+    # to a dict of file basename to file
+    watchers = {}
+    wd_files = {}
+    file_wds = {}
+    dir_files = {}
+
+    def watch(file_, on_modify):
+        try:
+            wd = _inotify_add_watch(inotify_fd, file_, IN_MODIFY)
+        except OSError:
+            on_modify.close()
+            raise
+        watchers[file_] = on_modify
+        wd_files[wd] = file_
+        file_wds[file_] = wd
+
+    def unwatch(file_):
+        wd = file_wds.pop(file_)
+        # Already gone if the kernel removed the watch
+        if wd_files.pop(wd, None) is not None:
+            _inotify_rm_watch(inotify_fd, wd)
+        watchers.pop(file_).close()
+
+    for file_ in watch_files:
+        # The parent directory is watched first, whether or not
+        # the file can be opened now, so that a missing (e.g. mid
+        # rotation) file is picked up once it is created
+        try:
+            dir_wd = _inotify_add_watch(
+                inotify_fd, os.path.dirname(file_) or '.', IN_DIR_EVENTS
+            )
+        except OSError:
+            log_syslog(traceback.format_exc())
+        else:
+            basename = os.fsencode(os.path.basename(file_))
+            dir_files.setdefault(dir_wd, {})[basename] = file_
+
+        try:
+            watch(file_, base_watcher(
+                file_, regex, syslog, from_addr, to_addrs
+            ))
+        except FileWatcherException:
+            # Invalid arguments, the same for every file
+            log_syslog(traceback.format_exc())
+            os.close(inotify_fd)
+            return
+        except Exception:
+            log_syslog(traceback.format_exc())
+
+    if not watchers and not dir_files:
+        os.close(inotify_fd)
+        return
+
+    # Sending mail blocks, so the handlers are run off the event
+    # loop, each file in its own worker thread; a stalled mail or
+    # a long scan for one file does not hold up the others
+    executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=len(watch_files)
+    )
+    # Files with events since their handler last started, as
+    # file to the set of 'modified', 'gone' and 'created'; and
+    # the tasks running the handlers (at most one per file). A
+    # burst of events on a file is handled in one go
+    pending = {}
+    running = {}
+
+    async def run_in_executor(func, *args):
+        try:
+            return await loop.run_in_executor(executor, func, *args)
+        except Exception:
+            log_syslog(traceback.format_exc())
+
+    async def run_watcher(file_):
+        try:
+            while file_ in pending:
+                events = pending.pop(file_)
+                on_modify = watchers.get(file_)
+                if on_modify is not None:
+                    # Whatever was appended before the file was
+                    # moved away or removed is still checked
+                    await run_in_executor(on_modify)
+                    if events & {'gone', 'created'}:
+                        unwatch(file_)
+                        if 'created' not in events:
+                            log_syslog(
+                                f'file: {file_}:: moved or removed, '
+                                'waiting for it to be recreated'
+                            )
+                if 'created' in events:
+                    # All of the new file's content is new
+                    on_modify = await run_in_executor(
+                        base_watcher, file_, regex, syslog, from_addr,
+                        to_addrs, True
+                    )
+                    if on_modify is None:
+                        continue
+                    try:
+                        watch(file_, on_modify)
+                    except OSError:
+                        log_syslog(traceback.format_exc())
+                        continue
+                    await run_in_executor(on_modify)
+        finally:
+            del running[file_]
+
+    def add_event(file_, event):
+        pending.setdefault(file_, set()).add(event)
+        if file_ not in running:
+            running[file_] = loop.create_task(run_watcher(file_))
+
+    def on_inotify_readable():
+        for wd, mask, name in _inotify_read(inotify_fd):
+            if wd in wd_files:
+                if mask & IN_IGNORED:
+                    add_event(wd_files.pop(wd), 'gone')
+                elif mask & IN_MODIFY:
+                    add_event(wd_files[wd], 'modified')
+            elif wd in dir_files:
+                if mask & IN_IGNORED:
+                    for file_ in dir_files.pop(wd).values():
+                        log_syslog(
+                            f'file: {file_}:: directory removed, '
+                            'file will not be followed if recreated'
+                        )
+                    continue
+                file_ = dir_files[wd].get(name)
+                if file_ is None:
+                    continue
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    add_event(file_, 'created')
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    add_event(file_, 'gone')
+
+    stop_event = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop_event.set)
+
+    loop.add_reader(inotify_fd, on_inotify_readable)
+    try:
+        await stop_event.wait()
+    finally:
+        loop.remove_reader(inotify_fd)
+        for task in list(running.values()):
+            task.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
+        os.close(inotify_fd)
 
 
 def main():
@@ -265,32 +742,15 @@ def main():
     a co-ordinator of all tasks.
     '''
     args_dict = parse_arguments()
-    regex = re.compile(r'{}'.format(args_dict.get('regex')))
+    # Compiled once here
+    regex = compile_regex(args_dict['regex'])
     syslog = args_dict.get('syslog', False)
     from_addr = args_dict.get('from_addr', '')
     to_addrs = args_dict.get('to_addrs', [])
     watch_files = args_dict.get('watch_files')
 
-    base_watcher_partial = functools.partial(
-        base_watcher,
-        # Applied args
-        regex=regex,
-        syslog=syslog,
-        from_addr=from_addr,
-        to_addrs=to_addrs,
-    )
+    asyncio.run(amain(watch_files, regex, syslog, from_addr, to_addrs))
 
-    # Multiprocessing pool with spawning capability of
-    # len(watch_files) subprocesses at a time
-    mp_pool = multiprocessing.Pool(processes=len(watch_files))
-    result = mp_pool.map_async(
-        base_watcher_partial,
-        watch_files,
-        error_callback=mp_error_callback
-    )
-    result.wait()
-    return vars(result).get('_success', True)
-    
 
 if __name__ == '__main__':
     main()